@@ -5,14 +5,38 @@ Assignment 2: Trees for Treemap
 This module contains the basic tree interface required by the treemap
 visualiser. You will both add to the abstract class, and complete a
 concrete implementation of a subclass to represent files and folders on your
-computer's file system.
+computer's file system. A second subclass represents the contents of zip and
+tar archives.
 """
 from __future__ import annotations
 
+import calendar
+import fnmatch
+import hashlib
+import json
 import math
 import os
-from random import randint
-from typing import List, Tuple, Optional
+import sys
+import tarfile
+import time
+import zipfile
+from random import randint, shuffle
+from typing import Iterator, List, Optional, Set, Tuple, Union
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+# In an estimated scan, folders with more than ESTIMATE_THRESHOLD files only
+# look at ESTIMATE_SAMPLE_SIZE of them.
+ESTIMATE_THRESHOLD = 1000
+ESTIMATE_SAMPLE_SIZE = 100
+
+# Paths left out of a bounded scan unless told otherwise: pseudo-filesystems,
+# whose sizes mean nothing, and the internals of git repositories.
+DEFAULT_EXCLUDES = ('/proc', '/sys', '/dev', '/run', '*/.git')
 
 
 def get_colour() -> Tuple[int, int, int]:
@@ -35,14 +59,85 @@ def get_colour() -> Tuple[int, int, int]:
     return tuple(rgb)
 
 
+def _convert_size(data_size: float, suffix: str = 'B') -> str:
+    """Returns <data_size> bytes as a human readable string, e.g. '1.50kB'.
+    """
+    suffixes = {'B': 'kB', 'kB': 'MB', 'MB': 'GB', 'GB': 'TB'}
+    if data_size < 1024 or suffix == 'TB':
+        return f'{data_size:.2f}{suffix}'
+    return _convert_size(data_size / 1024, suffixes[suffix])
+
+
+def _leaf_digest(name: str, data_size: int, mtime: int) -> bytes:
+    """Returns the digest of a file called <name> with the given size and
+    modification time.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f'{data_size}:{mtime}:'.encode())
+    digest.update(str(name).encode('utf-8', 'surrogateescape'))
+    return digest.digest()
+
+
+def _folder_digest(subtrees: List[TMTree]) -> bytes:
+    """Returns the digest of a folder holding <subtrees>, which covers the
+    name, known size and digest of each subtree regardless of their order.
+    A subtree whose size is partly a placeholder is marked as such instead of
+    having the placeholder hashed.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for sub in sorted(subtrees, key=lambda tree: tree._name):
+        digest.update(sub._name.encode('utf-8', 'surrogateescape'))
+        marker = '?' if sub._placeholder_size() else ''
+        digest.update(f'\0{_known_size(sub)}{marker}\0'.encode())
+        digest.update(sub._digest)
+    return digest.digest()
+
+
+def _known_size(tree: TMTree) -> int:
+    """Returns the part of the data_size of <tree> that is not a placeholder.
+    """
+    return tree.data_size - tree._placeholder_size()
+
+
+def _step_size(max_depth: int) -> int:
+    """Returns the step between the shades of grey of two consecutive depths
+    in a tree whose maximum depth is <max_depth>.
+    """
+    if max_depth > 1:
+        return math.floor(200 / (max_depth - 1))
+    elif max_depth == 0:
+        return 0
+    return math.floor(200)
+
+
+def _union(region: Optional[Tuple[int, int, int, int]],
+           rect: Tuple[int, int, int, int]) -> Tuple[int, int, int, int]:
+    """Returns the smallest rectangle containing <region> and <rect>.
+    """
+    if region is None:
+        return rect
+    left, top = min(region[0], rect[0]), min(region[1], rect[1])
+    right = max(region[0] + region[2], rect[0] + rect[2])
+    bottom = max(region[1] + region[3], rect[1] + rect[3])
+    return left, top, right - left, bottom - top
+
+
+def _link_visible(before: Optional[TMTree], after: Optional[TMTree]) -> None:
+    """Links <before> and <after> as neighbours in a chain of visible trees.
+    """
+    if before is not None:
+        before._next_visible = after
+    if after is not None:
+        after._prev_visible = before
+
+
 class TMTree:
     """A TreeMappableTree: a tree that is compatible with the treemap
     visualiser.
 
     This is an abstract class that should not be instantiated directly.
 
-    You may NOT add any attributes, public or private, to this class.
-    However, part of this assignment will involve you implementing new public
+    Part of this assignment will involve you implementing new public
     *methods* for this interface.
     You should not add any new public methods other than those required by
     the client code.
@@ -59,7 +154,20 @@ class TMTree:
     _parent_tree: The parent tree of this tree; i.e., the tree that contains
     this tree as a subtree, or None if this tree is not part of a larger tree.
     _expanded: Whether this tree is considered expanded for visualization.
+    _expanded_nodes: The set of expanded trees, kept only on the root of the
+    whole tree (None everywhere else).
+    _prev_visible: The visible tree immediately before this one, if this tree
+    is visible.
+    _next_visible: The visible tree immediately after this one, if this tree
+    is visible.
     _depth: The depth of this tree node in relation to the root.
+    _depth_counts: The number of nodes found at each depth below this tree,
+    kept only on the tree that update_colours_and_depths was last called on
+    (None everywhere else).
+    _digest: A summary of this tree as it was built: for a leaf, a hash of its
+    name, size and modification time; for a folder, a hash of the name, known
+    size and digest of each subtree. Two trees with the same digest and known
+    size are taken to be identical. Later edits do not update it.
 
     === Representation Invariants ===
     - data_size >= 0
@@ -74,6 +182,8 @@ class TMTree:
     - if _expanded is False, then _expanded is False for every tree
       in _subtrees
     - if _subtrees is empty, then _expanded is False
+    - if _expanded is True, then the visible trees underneath this tree are
+      linked from left to right through _next_visible and _prev_visible
     """
 
     rect: Tuple[int, int, int, int]
@@ -83,20 +193,32 @@ class TMTree:
     _subtrees: List[TMTree]
     _parent_tree: Optional[TMTree]
     _expanded: bool
+    _expanded_nodes: Optional[Set[TMTree]]
+    _prev_visible: Optional[TMTree]
+    _next_visible: Optional[TMTree]
     _depth: int
+    _depth_counts: Optional[List[int]]
+    _digest: bytes
 
     def __init__(self, name: str, subtrees: List[TMTree],
-                 data_size: int = 0) -> None:
+                 data_size: int = 0, mtime: int = 0) -> None:
         """Initializes a new TMTree with a random colour, the provided name
         and sets the subtrees to the list of provided subtrees. Sets this tree
         as the parent for each of its subtrees.
 
+        <mtime> is the modification time of a leaf, and is only used for its
+        digest.
+
         Precondition: if <name> is None, then <subtrees> is empty.
         """
         self.rect = (0, 0, 0, 0)
         self._parent_tree = None
         self._depth = 0
+        self._depth_counts = None
         self._expanded = False
+        self._expanded_nodes = None
+        self._prev_visible = None
+        self._next_visible = None
 
         # 1. Initialize: - self._name
         #                - self._colour (use the get_colour() function)
@@ -120,6 +242,11 @@ class TMTree:
                 tr._parent_tree = self
                 self.data_size += tr.data_size
 
+        if not self._subtrees:
+            self._digest = _leaf_digest(name, self.data_size, mtime)
+        else:
+            self._digest = _folder_digest(self._subtrees)
+
     def is_empty(self) -> bool:
         """Returns True iff this tree is empty.
         """
@@ -158,24 +285,106 @@ class TMTree:
 
     def update_rectangles_helper(self, rect: Tuple[int, int, int, int]) -> None:
         """ Helper method for update_rectangles """
+        for sub, sub_rect in zip(self._subtrees, self._split(rect)):
+            sub.update_rectangles(sub_rect)
+
+    def _split(self, rect: Tuple[int, int, int, int]) \
+            -> List[Tuple[int, int, int, int]]:
+        """Returns the rectangles that the treemap algorithm gives the subtrees
+        of this tree within <rect>, in order.
+        """
         x, y = rect[0], rect[1]
         tot_w = 0
         tot_h = 0
+        rects = []
         for sub in self._subtrees:
             if rect[2] > rect[3]:
                 wi = math.floor((sub.data_size / self.data_size) * rect[2])
                 if sub == self._subtrees[-1]:
-                    wi = self.rect[2] - tot_w
+                    wi = rect[2] - tot_w
                 tot_w += wi
-                sub.update_rectangles((x, y, wi, rect[3]))
+                rects.append((x, y, wi, rect[3]))
                 x += wi
             elif rect[2] <= rect[3]:
                 le = math.floor((sub.data_size / self.data_size) * rect[3])
                 if sub == self._subtrees[-1]:
-                    le = self.rect[3] - tot_h
+                    le = rect[3] - tot_h
                 tot_h += le
-                sub.update_rectangles((x, y, rect[2], le))
+                rects.append((x, y, rect[2], le))
                 y += le
+        return rects
+
+    def relayout(self, changed: List[TMTree]) \
+            -> Optional[Tuple[int, int, int, int]]:
+        """Updates the sizes and rectangles in this tree after each tree in
+        <changed> has changed size or had subtrees added or removed, and
+        returns the smallest rectangle covering every rectangle that moved, or
+        None if none did.
+
+        Only the ancestors of <changed> and the trees whose rectangles moved
+        are visited, instead of the whole tree.
+
+        Precondition: update_rectangles has been called on this tree, and
+        every tree in <changed> is in it.
+        """
+        # Map the changed trees and their ancestors to their depth below this
+        # tree, so that each one is summed after its changed descendants
+        dirty = {self: 0}
+        for node in changed:
+            path = []
+            while node is not self and node not in dirty:
+                path.append(node)
+                node = node._parent_tree
+            depth = dirty[node]
+            for node in reversed(path):
+                depth += 1
+                dirty[node] = depth
+        for node in sorted(dirty, key=dirty.get, reverse=True):
+            if node._subtrees:
+                node.data_size = sum(sub.data_size for sub in node._subtrees)
+
+        region = None
+        if self.data_size == 0:
+            return None
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            for sub, rect in zip(node._subtrees, node._split(node.rect)):
+                if sub.data_size == 0:
+                    rect = (0, 0, 0, 0)
+                if sub.rect != rect:
+                    for moved in (sub.rect, rect):
+                        if moved[2] and moved[3]:
+                            region = _union(region, moved)
+                    sub.update_rectangles(rect)
+                elif sub in dirty and sub.data_size:
+                    stack.append(sub)
+        return region
+
+    def get_layout(self) -> List[Tuple[TMTree,
+                                       Tuple[float, float, float, float]]]:
+        """Returns every tree in this tree paired with the left, top, right and
+        bottom edges of its current rectangle, given as fractions of the width
+        and height of this tree's rectangle. Trees that take up no space get
+        four zeros.
+
+        The layout can be scaled to any rectangle without running the treemap
+        algorithm again.
+        """
+        x0, y0, width, height = self.rect
+        layout = []
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            x, y, w, h = node.rect
+            if w == 0 or h == 0 or width == 0 or height == 0:
+                layout.append((node, (0.0, 0.0, 0.0, 0.0)))
+            else:
+                layout.append((node, ((x - x0) / width, (y - y0) / height,
+                                      (x + w - x0) / width,
+                                      (y + h - y0) / height)))
+            stack.extend(node._subtrees)
+        return layout
 
     def get_rectangles(self) -> List[Tuple[Tuple[int, int, int, int],
                                            Tuple[int, int, int]]]:
@@ -184,17 +393,36 @@ class TMTree:
         appropriate pygame rectangle to display for a leaf, and the colour
         to fill it with.
         """
-        lst = []
-        if self._subtrees == [] or not self._expanded:
-            lst.append((self.rect, self._colour))
-        else:
-            for tr in self._subtrees:
-                lst.extend(tr.get_rectangles())
-        return lst
-
         # NOTES: - This method will be modified in Task 6 to return both leaf
         #          nodes and internal nodes which are not expanded
         #
+        return [(node.rect, node._colour) for node in self._frontier()]
+
+    def get_rectangles_in(self, area: Tuple[int, int, int, int],
+                          min_size: int = 0) \
+            -> List[Tuple[Tuple[int, int, int, int], Tuple[int, int, int]]]:
+        """Returns the tuples of get_rectangles for the displayed trees whose
+        rectangles overlap <area>, without visiting the trees outside it.
+
+        An expanded tree whose rectangle is both narrower and shorter than
+        <min_size> is returned as a whole instead of its descendants, so that
+        a zoomed-out view does not visit trees too small to be seen.
+        """
+        ax, ay, aw, ah = area
+        lst = []
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            x, y, w, h = node.rect
+            if w == 0 or h == 0 or x >= ax + aw or y >= ay + ah \
+                    or x + w <= ax or y + h <= ay:
+                continue
+            if node._expanded and node._subtrees and \
+                    (w >= min_size or h >= min_size):
+                stack.extend(reversed(node._subtrees))
+            else:
+                lst.append((node.rect, node._colour))
+        return lst
 
     # **************************************************************************
     # **************** TASK 3: GET_TREE_AT_POSITION ****************************
@@ -211,35 +439,27 @@ class TMTree:
         # NOTES: - This method will be modified in Task 6 to return either a
         #          leaf node or an internal node which is not expanded
         #
-        if not self._subtrees:
-            lower = (self.rect[0], self.rect[1])
-            upper = (self.rect[0] + self.rect[2],
-                     self.rect[1] + self.rect[3])
-            if lower[0] <= pos[0] <= upper[0] and lower[1] <= pos[1] <= \
-                    upper[1]:
-                return self
+        # Only the trees whose rectangles contain <pos> are descended into,
+        # in the order they are displayed, so the first visible tree reached
+        # is the leftmost and topmost one.
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if not node._contains(pos):
+                continue
+            if node._expanded and node._subtrees:
+                stack.extend(reversed(node._subtrees))
             else:
-                return None
-        else:
-            lower = (self.rect[0], self.rect[1])
-            upper = (self.rect[0] + self.rect[2],
-                     self.rect[1] + self.rect[3])
-            if lower[0] <= pos[0] <= upper[0] and lower[1] <= pos[1] <= \
-                    upper[1]:
-                return self.get_tree_at_position_helper(pos)
+                return node
         return None
 
-    def get_tree_at_position_helper(self, pos: Tuple[int, int]) -> \
-            Optional[TMTree]:
-        """Helper function for get_tree_at_position.
+    def _contains(self, pos: Tuple[int, int]) -> bool:
+        """Returns whether <pos> lies inside or on the edge of the rectangle
+        of this tree.
         """
-        if self._expanded:
-            for sub in self._subtrees:
-                if sub.get_tree_at_position(pos) is not None:
-                    return sub.get_tree_at_position(pos)
-        else:
-            return self
-        return None
+        x, y, width, height = self.rect
+        return x <= pos[0] <= x + width and y <= pos[1] <= y + height
+
     # **************************************************************************
     # ********* TASK 4: MOVE, CHANGE SIZE, DELETE, UPDATE SIZES ****************
     # **************************************************************************
@@ -300,7 +520,7 @@ class TMTree:
         #          updated if the root node is attempted to be deleted
         #
         if self._parent_tree is not None:
-            self._parent_tree._subtrees.remove(self)
+            self._parent_tree._remove_subtree(self)
             if len(self._parent_tree._subtrees) == 0:
                 self._parent_tree.delete_self(True)
             val = True
@@ -324,6 +544,8 @@ class TMTree:
         """
         if not self._subtrees:
             return 0
+        if self._depth_counts is not None:
+            return len(self._depth_counts) - 1
         max_depth = 0
         stack = [(self, 0)]
         while stack:
@@ -351,19 +573,149 @@ class TMTree:
         instantiation. Updates the _depth and _colour attributes throughout
         the tree.
         """
-        # 1. Call the update depths method you wrote.
-        # 2. Find the maximum depth of the tree.
-        # 3. Use the maximum depth to determine the step_size.
-        # 4. Call the update_colours method and use step_size as the parameter.
-        self.update_depths()
-        maxd = self.max_depth()
-        if maxd > 1:
-            step_size = math.floor(200 / (maxd - 1))
-        elif maxd == 0:
-            step_size = 0
-        else:
-            step_size = math.floor(200)
-        self.update_colours(step_size)
+        # A single walk sets every depth, counts the nodes at each depth and
+        # collects the internal nodes. Once the walk is done the maximum depth
+        # is known, so the collected nodes can be coloured without another
+        # traversal. The counts are kept so that later changes to the tree can
+        # be applied incrementally (see _count_depths). Counts kept on any
+        # other tree above or below this one would no longer be kept up to
+        # date, so they are dropped.
+        ancestor = self._parent_tree
+        while ancestor is not None:
+            ancestor._depth_counts = None
+            ancestor = ancestor._parent_tree
+        counts = []
+        internal = []
+        stack = [(self, 0)]
+        while stack:
+            node, depth = stack.pop()
+            node._depth = depth
+            node._depth_counts = None
+            if depth == len(counts):
+                counts.append(0)
+            counts[depth] += 1
+            if node._subtrees:
+                internal.append(node)
+                for child in node._subtrees:
+                    stack.append((child, depth + 1))
+        self._depth_counts = counts
+
+        step_size = _step_size(len(counts) - 1)
+        for node in internal:
+            col = node._depth * step_size
+            node._colour = (col, col, col)
+
+    def _depth_root(self) -> Optional[TMTree]:
+        """Returns the ancestor that this tree's depth is measured from, i.e.
+        the tree update_colours_and_depths was last called on, or None if the
+        depths have not been computed yet.
+        """
+        root = self
+        for _ in range(self._depth):
+            if root._parent_tree is None:
+                return None
+            root = root._parent_tree
+        if root._depth_counts is None:
+            return None
+        return root
+
+    def _count_depths(self, subtree: TMTree, depth: int, delta: int) -> None:
+        """Adds <delta> to the depth counts of this tree for every node in
+        <subtree>, which is placed at <depth>. Inserted internal nodes are
+        coloured for their depth, and the whole tree is recoloured only if the
+        maximum depth has changed.
+
+        Precondition: this tree is the depth root of <subtree>'s parent.
+        """
+        counts = self._depth_counts
+        old_max = len(counts) - 1
+        internal = []
+        stack = [(subtree, depth)]
+        while stack:
+            node, d = stack.pop()
+            node._depth = d
+            if d == len(counts):
+                counts.append(0)
+            counts[d] += delta
+            if node._subtrees:
+                internal.append(node)
+                for child in node._subtrees:
+                    stack.append((child, d + 1))
+        while len(counts) > 1 and counts[-1] == 0:
+            counts.pop()
+
+        step_size = _step_size(len(counts) - 1)
+        if len(counts) - 1 != old_max:
+            self.update_colours(step_size)
+        elif delta > 0:
+            for node in internal:
+                col = node._depth * step_size
+                node._colour = (col, col, col)
+
+    def _add_subtree(self, subtree: TMTree) -> None:
+        """Appends <subtree> as the last subtree of this tree, and updates the
+        depths and colours of the nodes it brings in.
+        """
+        if self._expanded:
+            last = self._frontier_bounds()[1]
+            after = last._next_visible
+            first_new, last_new = subtree._frontier_bounds()
+            _link_visible(last, first_new)
+            _link_visible(last_new, after)
+        subtree._parent_tree = self
+        self._subtrees.append(subtree)
+        root = self._depth_root()
+        if root is not None:
+            root._count_depths(subtree, self._depth + 1, 1)
+        self._count_subtree(subtree, 1)
+
+    def _remove_subtree(self, subtree: TMTree) -> None:
+        """Removes <subtree> from the subtrees of this tree, and drops its
+        nodes from the depth counts and the visible trees. The parent of
+        <subtree> is left as is.
+
+        If this tree is left without subtrees it is no longer expanded.
+        """
+        if subtree._expanded:
+            subtree._collapse_expanded()
+        # A tree can be expanded while it is hidden underneath a collapsed
+        # one, so look for expanded trees left anywhere in <subtree>. None of
+        # them are linked to a chain outside <subtree>.
+        expanded = self._expanded_set()
+        stack = list(subtree._subtrees)
+        while stack:
+            node = stack.pop()
+            if node._expanded:
+                node._expanded = False
+                expanded.discard(node)
+            stack.extend(node._subtrees)
+        if self._expanded:
+            before, after = subtree._prev_visible, subtree._next_visible
+            if len(self._subtrees) == 1:
+                _link_visible(before, self)
+                _link_visible(self, after)
+                self._expanded = False
+                self._expanded_set().discard(self)
+            else:
+                _link_visible(before, after)
+        self._subtrees.remove(subtree)
+        root = self._depth_root()
+        if root is not None:
+            root._count_depths(subtree, subtree._depth, -1)
+        self._count_subtree(subtree, -1)
+
+    def _count_subtree(self, subtree: TMTree, sign: int) -> None:
+        """Updates what this tree and its ancestors count about their
+        descendants, now that <subtree> has been added underneath this tree
+        (<sign> is 1) or removed from it (<sign> is -1). TMTree itself keeps
+        no such counts.
+        """
+
+    def _placeholder_size(self) -> int:
+        """Returns the part of data_size that only stands in for sizes that
+        are not known. TMTree itself knows all of its sizes.
+        """
+        return 0
 
     # **************************************************************************
     # ********* TASK 6: EXPAND, COLLAPSE, EXPAND ALL, COLLAPSE ALL *************
@@ -372,19 +724,36 @@ class TMTree:
     def expand(self) -> None:
         """Sets this tree to be expanded. But not if it is a leaf.
         """
-        if self._subtrees:
+        if self._subtrees and not self._expanded:
+            nodes = []
+            for sub in self._subtrees:
+                nodes.extend(sub._frontier())
+            self._replace_frontier(nodes)
             self._expanded = True
+            self._expanded_set().add(self)
 
     def expand_all(self) -> None:
         """Sets this tree and all its descendants to be expanded, apart from the
         leaf nodes.
         """
         if self._subtrees:
-            self._expanded = True
-            for sub in self._subtrees:
-                sub.expand_all()
-
-    def collapse(self, count: int = 0) -> None:
+            leaves = []
+            internal = []
+            stack = [self]
+            while stack:
+                node = stack.pop()
+                if node._subtrees:
+                    internal.append(node)
+                    stack.extend(reversed(node._subtrees))
+                else:
+                    leaves.append(node)
+            self._replace_frontier(leaves)
+            expanded = self._expanded_set()
+            for node in internal:
+                node._expanded = True
+                expanded.add(node)
+
+    def collapse(self) -> None:
         """Collapses the parent tree of the given tree node and also collapse
         all of its descendants.
         """
@@ -393,14 +762,12 @@ class TMTree:
         #          should not be expanded, and any node underneath this tree
         #          should not be expanded.
         #
-        self._expanded = False
-        if count == 1:
-            for sub in self._subtrees:
-                sub.collapse(count)
+        # If the parent is not expanded, neither is anything below it except
+        # possibly this tree itself (when it is the root being displayed).
+        if self._parent_tree is not None and self._parent_tree._expanded:
+            self._parent_tree._collapse_expanded()
         else:
-            if self._parent_tree:
-                count = 1
-                self._parent_tree.collapse(count)
+            self._collapse_expanded()
 
     def collapse_all(self) -> None:
         """ Collapses ALL nodes in the tree.
@@ -409,12 +776,84 @@ class TMTree:
         # NOTES - This should work if it is called on any node in the tree.
         #       - After this method is called, _expanded should be set to false
         #         for all nodes in the tree.
-        self._expanded = False
-        if self._subtrees:
-            for sub in self._subtrees:
-                sub.collapse()
-        if self._parent_tree:
-            self._parent_tree.collapse_all()
+        # Once nothing is expanded no node is part of a chain of visible nodes,
+        # so only the flags of the expanded nodes need to be reset.
+        expanded = self._expanded_set()
+        for node in expanded:
+            node._expanded = False
+        expanded.clear()
+
+    def _collapse_expanded(self) -> None:
+        """Collapses this tree and every expanded tree underneath it, visiting
+        only the expanded trees.
+        """
+        if not self._expanded:
+            return
+        self._replace_frontier([self])
+        expanded = self._expanded_set()
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            node._expanded = False
+            expanded.discard(node)
+            for sub in node._subtrees:
+                if sub._expanded:
+                    stack.append(sub)
+
+    def _expanded_set(self) -> Set[TMTree]:
+        """Returns the set of expanded trees, which is kept on the root of the
+        whole tree.
+        """
+        root = self
+        while root._parent_tree is not None:
+            root = root._parent_tree
+        if root._expanded_nodes is None:
+            root._expanded_nodes = set()
+        return root._expanded_nodes
+
+    def _frontier_bounds(self) -> Tuple[TMTree, TMTree]:
+        """Returns the first and the last of the visible trees in the
+        displayed-tree rooted at this tree.
+        """
+        first = self
+        while first._expanded and first._subtrees:
+            first = first._subtrees[0]
+        last = self
+        while last._expanded and last._subtrees:
+            last = last._subtrees[-1]
+        return first, last
+
+    def _frontier(self) -> Iterator[TMTree]:
+        """Yields the visible trees in the displayed-tree rooted at this tree,
+        i.e. its leaves and the trees that are not expanded, from left to right.
+        """
+        node, last = self._frontier_bounds()
+        while node is not last:
+            yield node
+            node = node._next_visible
+        yield last
+
+    def _in_chain(self) -> bool:
+        """Returns whether the visible trees of this tree are linked into the
+        chain of their expanded ancestors, or start a chain of their own.
+        """
+        return self._expanded or (self._parent_tree is not None
+                                  and self._parent_tree._expanded)
+
+    def _replace_frontier(self, nodes: List[TMTree]) -> None:
+        """Replaces the visible trees of this tree, in the chain they belong
+        to, with <nodes>. This must be called before any expansion state is
+        changed, while the current visible trees can still be found.
+        """
+        first, last = self._frontier_bounds()
+        if self._in_chain():
+            before, after = first._prev_visible, last._next_visible
+        else:
+            before, after = None, None
+        for node in nodes:
+            _link_visible(before, node)
+            before = node
+        _link_visible(before, after)
 
     # **************************************************************************
     # ************* TASK 7 : DUPLICATE MOVE COPY_PASTE *************************
@@ -425,11 +864,10 @@ class TMTree:
         tree to be the last subtree of <destination>. Otherwise, does nothing.
         """
         if self._subtrees == [] and destination._subtrees != []:
-            new = FileSystemTree(self.get_full_path())
+            new = self._copy()
             new.data_size = self.data_size
-            new._parent_tree = destination
-            destination._subtrees.append(new)
-            self._parent_tree._subtrees.remove(self)
+            destination._add_subtree(new)
+            self._parent_tree._remove_subtree(self)
             self._parent_tree.data_size -= self.data_size
 
     def duplicate(self) -> Optional[TMTree]:
@@ -441,10 +879,8 @@ class TMTree:
         # NOTES: - make good use of the FileSystemTree constructor to
         #          instantiate a new node.
         if not self._subtrees and self._parent_tree:
-            path = self.get_full_path()
-            new_node = FileSystemTree(path)
-            new_node._parent_tree = self._parent_tree
-            self._parent_tree._subtrees.append(new_node)
+            new_node = self._copy()
+            self._parent_tree._add_subtree(new_node)
             return new_node
         return None
 
@@ -454,11 +890,9 @@ class TMTree:
         <destination>. Otherwise, does nothing.
         """
         if self._subtrees == [] and destination._subtrees != []:
-            path = self.get_full_path()
-            new_node = FileSystemTree(path)
+            new_node = self._copy()
             new_node.data_size = self.data_size
-            new_node._parent_tree = destination
-            destination._subtrees.append(new_node)
+            destination._add_subtree(new_node)
 
     # **************************************************************************
     # ************* HELPER FUNCTION FOR TESTING PURPOSES  **********************
@@ -502,6 +936,19 @@ class TMTree:
         """
         raise NotImplementedError
 
+    def _describe(self) -> List[str]:
+        """Returns the parts of the usual suffix of this tree: whether it is a
+        file or a folder, the number of items in a folder, and its size.
+        """
+        components = []
+        if len(self._subtrees) == 0:
+            components.append('file')
+        else:
+            components.append('folder')
+            components.append(f'{len(self._subtrees)} items')
+        components.append(_convert_size(self.data_size))
+        return components
+
     # **************************************************************************
     # **************** HELPER FUNCTION FOR TASK 7  *****************************
     # **************************************************************************
@@ -510,6 +957,150 @@ class TMTree:
         """
         raise NotImplementedError
 
+    def _copy(self) -> TMTree:
+        """Returns a new leaf for the same file as this leaf, which is used by
+        move, duplicate and copy_paste.
+        """
+        raise NotImplementedError
+
+
+class ScanLimits:
+    """The budget of a bounded FileSystemTree scan, and what the scan used.
+
+    Once the scan has created max_nodes trees, or runs past its time budget,
+    the folders it has not listed yet become summary leaves. So do the
+    folders deeper than max_depth. A folder that has been started is always
+    listed in full, so the number of trees may go somewhat past max_nodes.
+
+    A summary leaf is sized by adding up the sizes of the files under it
+    without creating any trees. Its size is unknown if measure is False, or
+    if the time budget or the max_measured entries shared by every summary
+    of the scan run out first. It is then given a placeholder size so that it
+    still shows up in the treemap.
+
+    === Public Attributes ===
+    max_nodes: the number of trees after which folders are summarised, or
+        None for no limit.
+    max_depth: the depth, with the root at depth 0, from which folders are
+        summarised, or None for no limit.
+    time_budget: the number of seconds after which folders are summarised,
+        or None for no limit.
+    excludes: fnmatch patterns for the absolute paths left out of the scan.
+        The root of the scan is never left out.
+    measure: whether to find the size of summarised folders.
+    max_measured: the number of entries after which summarised folders are
+        no longer measured, or None for no limit.
+    nodes: the number of trees created by the last scan.
+    summaries: the number of summary leaves created by the last scan.
+    measured: the number of entries looked at to measure summarised folders
+        in the last scan.
+    elapsed: the number of seconds the last scan took.
+    peak_memory: the peak memory use, in bytes, of this process after the
+        last scan, or None if it cannot be found on this computer.
+
+    === Private Attributes ===
+    _root: the path of the scan in progress, or None if there is none.
+    _deadline: the time.monotonic() after which the scan in progress is out
+        of time, or None if it has no time budget.
+    _started: the time.monotonic() at which the scan in progress started.
+    """
+    max_nodes: Optional[int]
+    max_depth: Optional[int]
+    time_budget: Optional[float]
+    excludes: Tuple[str, ...]
+    measure: bool
+    max_measured: Optional[int]
+    nodes: int
+    summaries: int
+    measured: int
+    elapsed: float
+    peak_memory: Optional[int]
+    _root: Optional[str]
+    _deadline: Optional[float]
+    _started: float
+
+    def __init__(self, max_nodes: Optional[int] = None,
+                 max_depth: Optional[int] = None,
+                 time_budget: Optional[float] = None,
+                 excludes: Tuple[str, ...] = DEFAULT_EXCLUDES,
+                 measure: bool = True,
+                 max_measured: Optional[int] = 100000) -> None:
+        """Initializes the limits of a scan. Every limit left as None is not
+        enforced.
+        """
+        self.max_nodes = max_nodes
+        self.max_depth = max_depth
+        self.time_budget = time_budget
+        self.excludes = tuple(excludes)
+        self.measure = measure
+        self.max_measured = max_measured
+        self.nodes = 0
+        self.summaries = 0
+        self.measured = 0
+        self.elapsed = 0.0
+        self.peak_memory = None
+        self._root = None
+        self._deadline = None
+        self._started = 0.0
+
+    def start(self, path: str) -> bool:
+        """Starts a scan of <path> and returns True, unless a scan is already
+        in progress, in which case returns False.
+        """
+        if self._root is not None:
+            return False
+        self._root = path
+        self._started = time.monotonic()
+        self._deadline = None if self.time_budget is None \
+            else self._started + self.time_budget
+        self.nodes = 0
+        self.summaries = 0
+        self.measured = 0
+        return True
+
+    def finish(self) -> None:
+        """Records the time and memory taken by the scan in progress.
+        """
+        self._root = None
+        self.elapsed = time.monotonic() - self._started
+        if resource is None:
+            self.peak_memory = None
+        else:
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # Linux reports kilobytes, macOS bytes
+            self.peak_memory = peak if sys.platform == 'darwin' else peak * 1024
+
+    def excluded(self, path: str) -> bool:
+        """Returns whether <path> is left out of the scan.
+        """
+        path = os.path.abspath(path)
+        return any(fnmatch.fnmatch(path, pattern) for pattern in self.excludes)
+
+    def out_of_time(self) -> bool:
+        """Returns whether the scan in progress has run out of time.
+        """
+        return self._deadline is not None and time.monotonic() >= self._deadline
+
+    def exhausted(self, path: str) -> bool:
+        """Returns whether the folder at <path> should be summarised instead
+        of listed.
+        """
+        if self.max_nodes is not None and self.nodes >= self.max_nodes:
+            return True
+        if self.max_depth is not None and \
+                os.path.relpath(path, self._root).count(os.sep) + 1 \
+                >= self.max_depth:
+            return True
+        return self.out_of_time()
+
+    def report(self) -> str:
+        """Returns a summary of what the last scan used.
+        """
+        memory = 'unknown' if self.peak_memory is None \
+            else _convert_size(self.peak_memory)
+        return f'Scanned {self.nodes} trees ({self.summaries} summarised) ' \
+               f'in {self.elapsed:.2f}s, peak memory {memory}'
+
 
 class FileSystemTree(TMTree):
     """A tree representation of files and folders in a file system.
@@ -523,15 +1114,49 @@ class FileSystemTree(TMTree):
     The data_size attribute for regular files is simply the size of the file,
     as reported by os.path.getsize.
 
+    In an estimated scan, the size of some files is extrapolated from a sample
+    of the other files in their folder, until refine replaces it with the
+    exact size. The digests of an estimated scan should not be compared with
+    those of another scan.
+
+    In a scan bounded by ScanLimits, the folders the scan did not list are
+    leaves summarising them. A summary whose size is unknown is given the
+    median size of the other trees in its folder, or 1 if there are none, as
+    a placeholder so that it takes up some room in the treemap. The sizes of
+    the folders holding it are then lower bounds, not counting placeholders.
+
     === Private Attributes ===
     _path: the path that was used to instantiate this tree.
+    _estimates: the number of files in this tree whose size is an estimate.
+    _variance: the variance of the estimate of data_size, or 0 if it is exact.
+    _unexplored: whether this tree is a leaf summarising a folder that was
+        not listed.
+    _unknown: the number of summary leaves in this tree whose size is
+        unknown.
+    _placeholder: the part of data_size made up of the placeholder sizes of
+        those summary leaves.
     """
     _path: str
-
-    def __init__(self, my_path: str) -> None:
+    _estimates: int
+    _variance: float
+    _unexplored: bool
+    _unknown: int
+    _placeholder: int
+
+    def __init__(self, my_path: str, estimate: bool = False,
+                 limits: Optional[ScanLimits] = None) -> None:
         """Stores the directory given by <my_path> into a tree data structure
         using the TMTree class.
 
+        If <estimate> is True, every folder is listed in full, but in folders
+        holding more than ESTIMATE_THRESHOLD files only ESTIMATE_SAMPLE_SIZE
+        of them are looked at, and the size of the others is estimated from
+        that sample.
+
+        If <limits> is given, the scan stays within its budget, leaves out the
+        paths it excludes and skips the paths it cannot read. The limits then
+        hold what the scan used.
+
         Precondition: <my_path> is a valid path for this computer.
         """
         # 1. Initialize the single attribute: self._path
@@ -543,50 +1168,649 @@ class FileSystemTree(TMTree):
         #          initializer. Thus, set data_size = 0 for the folders
         subtrees = []
         self._path = my_path
-        if os.path.isdir(self._path):
-            ls = os.listdir(self._path)
-            for pa in ls:
-                pat = os.path.join(self._path, pa)
-                subtrees.append(FileSystemTree(pat))
-        size = os.path.getsize(self._path)
-        name = os.path.basename(self._path)
-        super().__init__(name, subtrees, size)
+        started = limits is not None and limits.start(my_path)
+        if limits is not None:
+            limits.nodes += 1
+        try:
+            if os.path.isdir(self._path):
+                if estimate:
+                    subtrees = self._scan_sampled(limits)
+                else:
+                    ls = os.listdir(self._path)
+                    for pa in ls:
+                        pat = os.path.join(self._path, pa)
+                        subtree = _scan_path(pat, False, limits)
+                        if subtree is not None:
+                            subtrees.append(subtree)
+            stat = os.stat(self._path)
+        finally:
+            if started:
+                limits.finish()
+        if limits is not None:
+            _place_unknown(subtrees)
+        self._set_up(subtrees, stat.st_size, stat.st_mtime_ns)
+
+    @classmethod
+    def _leaf(cls, path: str, data_size: int, mtime: int = 0,
+              variance: Optional[float] = None, unexplored: bool = False,
+              unknown: bool = False) -> FileSystemTree:
+        """Returns a leaf for <path> of the given size without looking at
+        <path>. The other arguments are described in _set_up.
+        """
+        leaf = cls.__new__(cls)
+        leaf._path = path
+        leaf._set_up([], data_size, mtime, variance, unexplored, unknown)
+        return leaf
+
+    def _set_up(self, subtrees: List[FileSystemTree], data_size: int,
+                mtime: int, variance: Optional[float] = None,
+                unexplored: bool = False, unknown: bool = False) -> None:
+        """Initializes this tree for the file or folder at _path, given its
+        <subtrees>. A folder adds up what it knows of its subtrees.
+
+        The other arguments only apply to a leaf: <variance> is the variance
+        of its size if that size is an estimate, <unexplored> is whether it
+        summarises a folder that was not listed, and <unknown> is whether the
+        size of that folder is unknown.
+        """
+        super().__init__(os.path.basename(self._path), subtrees, data_size,
+                         mtime)
+        self._unexplored = unexplored
+        if subtrees:
+            self._estimates = sum(sub._estimates for sub in subtrees)
+            self._variance = sum(sub._variance for sub in subtrees)
+            self._unknown = sum(sub._unknown for sub in subtrees)
+            self._placeholder = sum(sub._placeholder for sub in subtrees)
+        else:
+            self._estimates = int(variance is not None)
+            self._variance = variance or 0.0
+            self._unknown = int(unknown)
+            self._placeholder = 0
+
+    def _scan_sampled(self, limits: Optional[ScanLimits] = None) \
+            -> List[FileSystemTree]:
+        """Returns the subtrees of this folder for an estimated scan.
+
+        The size of a file left out of the sample is the mean size of the
+        sampled files. The variance of the folder's estimated total, with the
+        finite population correction, is shared out evenly between them.
+        """
+        folders = []
+        files = []
+        with os.scandir(self._path) as entries:
+            for entry in entries:
+                if limits is not None and limits.excluded(entry.path):
+                    continue
+                if entry.is_dir():
+                    folders.append(entry.path)
+                else:
+                    files.append(entry.path)
+        subtrees = [_scan_path(path, True, limits) for path in folders]
+        if len(files) <= ESTIMATE_THRESHOLD:
+            subtrees.extend(_scan_path(path, False, limits) for path in files)
+            return [subtree for subtree in subtrees if subtree is not None]
+
+        # Files that cannot be read are left out of the sample, and replaced
+        # by the next files until the sample is full. If the files run out
+        # first, every file has been looked at and nothing is estimated.
+        shuffle(files)
+        subtrees = [subtree for subtree in subtrees if subtree is not None]
+        sampled = []
+        i = 0
+        while len(sampled) < ESTIMATE_SAMPLE_SIZE and i < len(files):
+            leaf = _scan_path(files[i], False, limits)
+            if leaf is not None:
+                sampled.append(leaf)
+            i += 1
+        if i == len(files):
+            return subtrees + sampled
+        sizes = [leaf.data_size for leaf in sampled]
+        n, total = len(sizes), len(sizes) + len(files) - i
+        mean = sum(sizes) / n
+        sample_variance = sum((size - mean) ** 2 for size in sizes) / (n - 1)
+        variance = total * total * (1 - n / total) * sample_variance / n
+        share = variance / (total - n)
+        subtrees.extend(sampled)
+        subtrees.extend(FileSystemTree._leaf(path, round(mean), variance=share)
+                        for path in files[i:])
+        if limits is not None:
+            limits.nodes += len(files) - i
+        return subtrees
+
+    def refine(self, limit: int = 256,
+               refined_leaves: Optional[List[FileSystemTree]] = None) -> int:
+        """Replaces up to <limit> estimated file sizes in this tree with the
+        exact sizes, updating the size of every ancestor, and returns how many
+        were replaced. Returns 0 once every size in this tree is exact.
+
+        If <refined_leaves> is given, the leaves whose sizes were replaced are
+        appended to it.
+        """
+        refined = 0
+        stack = [self]
+        while stack and refined < limit:
+            node = stack.pop()
+            if node._estimates == 0:
+                continue
+            if node._subtrees:
+                stack.extend(node._subtrees)
+            else:
+                node._refine_file()
+                refined += 1
+                if refined_leaves is not None:
+                    refined_leaves.append(node)
+        return refined
+
+    def _refine_file(self) -> None:
+        """Replaces the estimated size of this file with its exact size. If
+        the file can no longer be read, the estimate is kept as its size.
+        """
+        try:
+            data_size = os.stat(self._path).st_size
+        except OSError:
+            data_size = self.data_size
+        change = data_size - self.data_size
+        variance = self._variance
+        node = self
+        while node is not None:
+            node.data_size += change
+            node._estimates -= 1
+            node._variance -= variance
+            node = node._parent_tree
+
+    def _count_subtree(self, subtree: FileSystemTree, sign: int) -> None:
+        """Updates the estimated and unknown sizes counted by this tree and
+        its ancestors for <subtree> being added or removed.
+        """
+        node = self
+        while node is not None:
+            node._estimates += sign * subtree._estimates
+            node._variance += sign * subtree._variance
+            node._unknown += sign * subtree._unknown
+            node._placeholder += sign * subtree._placeholder
+            node = node._parent_tree
+
+    def _placeholder_size(self) -> int:
+        """Returns the placeholder sizes given to the summaries of unknown
+        size in this tree.
+        """
+        return self._placeholder
 
     def get_full_path(self) -> str:
         """Returns the file path for the tree object.
         """
         return self._path
 
+    def _copy(self) -> FileSystemTree:
+        """Returns a new leaf for the file at the path of this leaf. A copy of
+        a leaf whose size is an estimate or a summary keeps it as one.
+        """
+        if self._unexplored and self._unknown:
+            leaf = _summary_folder(self._path, None)
+            leaf.data_size = leaf._placeholder = self._placeholder
+            return leaf
+        if self._unexplored:
+            return _summary_folder(self._path, self.data_size)
+        if self._estimates:
+            return FileSystemTree._leaf(self._path, self.data_size,
+                                        variance=self._variance)
+        return FileSystemTree(self._path)
+
     def get_separator(self) -> str:
         """Returns the file separator for this OS.
         """
         return os.sep
 
+    def get_suffix(self) -> str:
+        """Returns the final descriptor of this tree. An estimated size is
+        shown with the half-width of its 95% confidence interval, and the size
+        of a folder holding summaries of unknown size as a lower bound.
+        """
+        components = self._describe()
+        if self._unexplored:
+            components[0] = 'unexplored folder'
+            if self._unknown:
+                components[-1] = 'size unknown'
+        elif self._unknown:
+            known = self.data_size - self._placeholder
+            components[-1] = f'≥{_convert_size(known)}'
+        if self._estimates:
+            error = 1.96 * math.sqrt(max(self._variance, 0))
+            components[-1] = f'~{components[-1]} ± {_convert_size(error)}'
+        return f' ({", ".join(components)})'
+
+
+def _scan_path(path: str, estimate: bool,
+               limits: Optional[ScanLimits]) -> Optional[FileSystemTree]:
+    """Returns the FileSystemTree for <path> in a scan bounded by <limits>,
+    or a summary leaf if it is a folder the scan has no budget left to list.
+    Returns None if the scan leaves <path> out or cannot read it.
+    """
+    if limits is None:
+        return FileSystemTree(path, estimate)
+    if limits.excluded(path):
+        return None
+    is_dir = os.path.isdir(path)
+    if is_dir and limits.exhausted(path):
+        return _summary_folder(path, _disk_usage(path, limits)
+                               if limits.measure else None, limits)
+    nodes, summaries = limits.nodes, limits.summaries
+    try:
+        return FileSystemTree(path, estimate, limits)
+    except OSError:
+        # Nothing created for <path> before it failed is kept
+        limits.nodes, limits.summaries = nodes, summaries
+        return _summary_folder(path, None, limits) if is_dir else None
+
+
+def _summary_folder(path: str, data_size: Optional[int],
+                    limits: Optional[ScanLimits] = None) -> FileSystemTree:
+    """Returns a FileSystemTree leaf summarising the folder at <path>
+    without listing it, given the total size <data_size> of the files under
+    it, or None if that size is unknown.
+    """
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        mtime = 0
+    leaf = FileSystemTree._leaf(path, data_size or 0, mtime, unexplored=True,
+                                unknown=data_size is None)
+    if limits is not None:
+        limits.nodes += 1
+        limits.summaries += 1
+    return leaf
+
+
+def _place_unknown(subtrees: List[FileSystemTree]) -> None:
+    """Gives the summaries of unknown size among <subtrees> the median size of
+    the others, or 1 if there are none, as a placeholder.
+    """
+    unknown = [sub for sub in subtrees if sub._unexplored and sub._unknown]
+    if not unknown:
+        return
+    known = sorted(sub.data_size for sub in subtrees
+                   if not (sub._unexplored and sub._unknown))
+    size = max(known[len(known) // 2], 1) if known else 1
+    for sub in unknown:
+        sub.data_size = sub._placeholder = size
+
+
+def _disk_usage(path: str, limits: ScanLimits) -> Optional[int]:
+    """Returns the total size of the files under the folder at <path>, like
+    du, without following symbolic links or creating any trees. Returns None
+    if the scan bounded by <limits> runs out of time or of entries to measure
+    first.
+    """
+    total = 0
+    stack = [path]
+    while stack:
+        if limits.out_of_time():
+            return None
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                if limits.max_measured is not None and \
+                        limits.measured >= limits.max_measured:
+                    return None
+                limits.measured += 1
+                if limits.excluded(entry.path):
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    else:
+                        total += entry.stat(follow_symlinks=False).st_size
+                except OSError:
+                    pass
+    return total
+
+
+class ArchiveTree(TMTree):
+    """A tree representation of the files and folders stored in a zip or tar
+    archive, read from the archive's metadata without extracting it.
+
+    The _name attribute stores the *name* of the folder or file inside the
+    archive, and the root is named after the archive file itself.
+
+    The data_size attribute for files is the uncompressed size of the member,
+    or its compressed size if the tree was built with compressed=True.
+
+    === Private Attributes ===
+    _path: the path of the archive followed by the path of this member inside
+    the archive, e.g. 'release.zip/bin/tool'.
+    """
+    _path: str
+
+    def __init__(self, name: str, subtrees: List[ArchiveTree], path: str,
+                 data_size: int = 0, mtime: int = 0) -> None:
+        """Initializes a new ArchiveTree for the member <name> of an archive,
+        found at <path>.
+        """
+        self._path = path
+        super().__init__(name, subtrees, data_size, mtime)
+
+    def get_full_path(self) -> str:
+        """Returns the path of the archive followed by the path of this member.
+        """
+        return self._path
+
+    def _copy(self) -> ArchiveTree:
+        """Returns a new leaf for the same member as this leaf.
+        """
+        return ArchiveTree(self._name, [], self._path, self.data_size)
+
+    def get_separator(self) -> str:
+        """Returns the separator used for member names in archives.
+        """
+        return '/'
+
     def get_suffix(self) -> str:
         """Returns the final descriptor of this tree.
         """
+        return f' ({", ".join(self._describe())})'
 
-        def convert_size(data_size: float, suffix: str = 'B') -> str:
-            suffixes = {'B': 'kB', 'kB': 'MB', 'MB': 'GB', 'GB': 'TB'}
-            if data_size < 1024 or suffix == 'TB':
-                return f'{data_size:.2f}{suffix}'
-            return convert_size(data_size / 1024, suffixes[suffix])
 
-        components = []
-        if len(self._subtrees) == 0:
-            components.append('file')
+def build_archive_tree(archive_path: str,
+                       compressed: bool = False) -> ArchiveTree:
+    """Returns an ArchiveTree of the zip or tar archive at <archive_path>.
+
+    Nothing is extracted: a zip archive is read from its central directory,
+    and a tar archive (which may be gzip, bzip2 or xz compressed) is read one
+    header at a time, seeking past the data of each member. If <compressed> is True, the
+    files of a zip archive are sized by their compressed size. Members of a
+    tar archive are not compressed individually, so they always use the size
+    recorded in their header.
+
+    Precondition: <archive_path> is a valid zip or tar archive.
+    """
+    root = {}
+    for member, is_dir, size, mtime in _archive_members(archive_path,
+                                                        compressed):
+        parts = [part for part in member.split('/') if part not in ('', '.')]
+        if not parts:
+            continue
+        folder = root
+        for part in parts[:-1]:
+            if not isinstance(folder.get(part), dict):
+                folder[part] = {}
+            folder = folder[part]
+        if is_dir:
+            if not isinstance(folder.get(parts[-1]), dict):
+                folder[parts[-1]] = {}
+        elif not isinstance(folder.get(parts[-1]), dict):
+            folder[parts[-1]] = (size, mtime)
+    return _build_archive_tree(os.path.basename(archive_path), root,
+                               archive_path)
+
+
+def _archive_members(archive_path: str, compressed: bool) \
+        -> Iterator[Tuple[str, bool, int, int]]:
+    """Yields the name, whether it is a directory, the size and the
+    modification time of every member of the archive at <archive_path>.
+    """
+    # zipfile.is_zipfile looks for a central directory near the end of the
+    # file, which a tar ending in a zip or jar member also has. So a file is
+    # only taken for a zip by its central directory if it does not start
+    # with a zip signature and is not a tar, as with self-extracting zips.
+    with open(archive_path, 'rb') as archive:
+        is_zip = archive.read(4) in (b'PK\x03\x04', b'PK\x05\x06')
+    if not is_zip and not tarfile.is_tarfile(archive_path):
+        is_zip = zipfile.is_zipfile(archive_path)
+    if is_zip:
+        with zipfile.ZipFile(archive_path) as archive:
+            for info in archive.infolist():
+                size = info.compress_size if compressed else info.file_size
+                yield info.filename, info.is_dir(), size, \
+                    calendar.timegm(info.date_time)
+    else:
+        with tarfile.open(archive_path, 'r:*') as archive:
+            for info in archive:
+                yield info.name, info.isdir(), \
+                    info.size if info.isfile() else 0, int(info.mtime)
+                # The headers are only needed once, so do not let the
+                # archive keep every one of them in memory.
+                archive.members = []
+
+
+def _build_archive_tree(name: str, entry: Union[dict, Tuple[int, int]],
+                        path: str) -> ArchiveTree:
+    """Returns the ArchiveTree for <entry>, which is either the size and
+    modification time of a file or a dict mapping the names in a folder to
+    their entries.
+    """
+    if isinstance(entry, dict):
+        subtrees = [_build_archive_tree(child, entry[child], path + '/' + child)
+                    for child in entry]
+        return ArchiveTree(name, subtrees, path)
+    return ArchiveTree(name, [], path, entry[0], entry[1])
+
+
+class SnapshotTree(TMTree):
+    """A tree loaded from a scan saved with save_scan.
+
+    === Private Attributes ===
+    _path: the path of this file or folder when it was scanned.
+    _separator: the separator used in the paths of the scanned tree.
+    _placeholder: the part of data_size that was a placeholder for sizes
+        that were not known when it was scanned.
+    """
+    _path: str
+    _separator: str
+    _placeholder: int
+
+    def __init__(self, name: str, subtrees: List[SnapshotTree], path: str,
+                 separator: str, data_size: int = 0,
+                 digest: Optional[bytes] = None, placeholder: int = 0) -> None:
+        """Initializes a new SnapshotTree. A leaf keeps the <digest> and
+        <placeholder> it had when it was scanned; those of a folder are
+        rebuilt from its subtrees.
+        """
+        self._path = path
+        self._separator = separator
+        if subtrees:
+            placeholder = sum(sub._placeholder for sub in subtrees)
+        self._placeholder = placeholder
+        super().__init__(name, subtrees, data_size)
+        if digest is not None and not subtrees:
+            self._digest = digest
+
+    def get_full_path(self) -> str:
+        """Returns the path of this tree when it was scanned.
+        """
+        return self._path
+
+    def _copy(self) -> SnapshotTree:
+        """Returns a new leaf for the same file as this leaf.
+        """
+        return SnapshotTree(self._name, [], self._path, self._separator,
+                            self.data_size, self._digest, self._placeholder)
+
+    def _placeholder_size(self) -> int:
+        """Returns the placeholder sizes this tree had when it was scanned.
+        """
+        return self._placeholder
+
+    def get_separator(self) -> str:
+        """Returns the separator used in the paths of the scanned tree.
+        """
+        return self._separator
+
+    def get_suffix(self) -> str:
+        """Returns the final descriptor of this tree.
+        """
+        return f' ({", ".join(self._describe())})'
+
+
+def save_scan(tree: TMTree, scan_path: str) -> None:
+    """Saves <tree> to the file at <scan_path>, so that it can be loaded again
+    with load_scan and compared with a later scan using diff_trees.
+
+    The file holds a header line followed by one line per tree, in preorder.
+    """
+    with open(scan_path, 'w', encoding='utf-8') as file:
+        json.dump({'path': tree.get_full_path(),
+                   'separator': tree.get_separator()}, file)
+        file.write('\n')
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            json.dump([node._name, len(node._subtrees), node.data_size,
+                       node._digest.hex(), node._placeholder_size()], file)
+            file.write('\n')
+            stack.extend(reversed(node._subtrees))
+
+
+def load_scan(scan_path: str) -> SnapshotTree:
+    """Returns the tree saved with save_scan in the file at <scan_path>.
+
+    Precondition: <scan_path> is a file written by save_scan.
+    """
+    with open(scan_path, encoding='utf-8') as file:
+        header = json.loads(next(file))
+        return _load_snapshot(file, header['separator'], header['path'])
+
+
+def _load_snapshot(lines: Iterator[str], separator: str,
+                   path: Optional[str] = None,
+                   parent_path: Optional[str] = None) -> SnapshotTree:
+    """Returns the SnapshotTree whose line is the next one in <lines>, along
+    with all of its subtrees.
+    """
+    name, count, data_size, digest, *placeholder = json.loads(next(lines))
+    if path is None:
+        path = parent_path + separator + name
+    subtrees = [_load_snapshot(lines, separator, parent_path=path)
+                for _ in range(count)]
+    return SnapshotTree(name, subtrees, path, separator, data_size,
+                        bytes.fromhex(digest),
+                        placeholder[0] if placeholder else 0)
+
+
+class DeltaTree(TMTree):
+    """A tree of the changes between two scans of the same folder, built by
+    diff_trees.
+
+    Only the files and folders that changed are included. The data_size of a
+    leaf is the number of bytes added plus the number of bytes removed, so
+    rectangles are sized by how much changed. Leaves that grew are green and
+    leaves that shrank are red. A file or folder that only exists in one of
+    the scans is a single leaf.
+
+    === Private Attributes ===
+    _path: the path of this file or folder in the newer scan, or in the older
+    scan if it was removed.
+    _separator: the separator used in the paths of the scans.
+    _added: the number of bytes added in this tree.
+    _removed: the number of bytes removed in this tree.
+    """
+    _path: str
+    _separator: str
+    _added: int
+    _removed: int
+
+    def __init__(self, name: str, subtrees: List[DeltaTree], path: str,
+                 separator: str, added: int = 0, removed: int = 0) -> None:
+        """Initializes a new DeltaTree. For a folder, <added> and <removed>
+        are the totals of its subtrees.
+        """
+        self._path = path
+        self._separator = separator
+        super().__init__(name, subtrees, added + removed)
+        if subtrees:
+            self._added = sum(sub._added for sub in subtrees)
+            self._removed = sum(sub._removed for sub in subtrees)
         else:
-            components.append('folder')
-            components.append(f'{len(self._subtrees)} items')
-        components.append(convert_size(self.data_size))
+            self._added = added
+            self._removed = removed
+            if added >= removed:
+                self._colour = (60, 180, 75)
+            else:
+                self._colour = (220, 50, 50)
+
+    def get_full_path(self) -> str:
+        """Returns the path of the file or folder that changed.
+        """
+        return self._path
+
+    def _copy(self) -> DeltaTree:
+        """Returns a new leaf with the same changes as this leaf.
+        """
+        return DeltaTree(self._name, [], self._path, self._separator,
+                         self._added, self._removed)
+
+    def get_separator(self) -> str:
+        """Returns the separator used in the paths of the scans.
+        """
+        return self._separator
+
+    def get_suffix(self) -> str:
+        """Returns the final descriptor of this tree: the bytes added and
+        removed.
+        """
+        components = self._describe()[:-1]
+        components.append('+' + _convert_size(self._added))
+        components.append('-' + _convert_size(self._removed))
         return f' ({", ".join(components)})'
 
 
+def _size_unknown(tree: TMTree) -> bool:
+    """Returns whether <tree> is a leaf whose whole size is a placeholder.
+    """
+    return not tree._subtrees and tree._placeholder_size() > 0
+
+
+def diff_trees(old: TMTree, new: TMTree) -> Optional[DeltaTree]:
+    """Returns a DeltaTree of what was added and removed between the scans
+    <old> and <new> of the same folder, or None if nothing changed.
+
+    Subtrees with the same digest and known size in both scans are skipped
+    without looking inside them. Placeholder sizes are never counted, and a
+    summary of unknown size in either scan is left out of the result.
+    """
+    if _known_size(old) == _known_size(new) and old._digest == new._digest:
+        return None
+    separator = new.get_separator()
+    if not old._subtrees or not new._subtrees:
+        if _size_unknown(old) or _size_unknown(new):
+            return None
+        added, removed = _known_size(new), _known_size(old)
+        if not old._subtrees and not new._subtrees:
+            added, removed = max(added - removed, 0), max(removed - added, 0)
+        if added == removed == 0:
+            return None
+        return DeltaTree(new._name, [], new.get_full_path(), separator,
+                         added, removed)
+
+    old_subtrees = {sub._name: sub for sub in old._subtrees}
+    subtrees = []
+    for sub in new._subtrees:
+        match = old_subtrees.pop(sub._name, None)
+        if match is not None:
+            delta = diff_trees(match, sub)
+            if delta is not None:
+                subtrees.append(delta)
+        elif _known_size(sub) > 0:
+            subtrees.append(DeltaTree(sub._name, [], sub.get_full_path(),
+                                      separator, added=_known_size(sub)))
+    for sub in old_subtrees.values():
+        if _known_size(sub) > 0:
+            subtrees.append(DeltaTree(sub._name, [], sub.get_full_path(),
+                                      separator, removed=_known_size(sub)))
+    if not subtrees:
+        return None
+    return DeltaTree(new._name, subtrees, new.get_full_path(), separator)
+
+
 if __name__ == '__main__':
     import python_ta
 
     python_ta.check_all(config={
         'allowed-import-modules': [
-            'python_ta', 'typing', 'math', 'random', 'os', '__future__'
+            'python_ta', 'typing', 'calendar', 'fnmatch', 'hashlib', 'json',
+            'math', 'random', 'os', 'resource', 'sys', 'tarfile', 'time',
+            'zipfile', '__future__'
         ]
     })
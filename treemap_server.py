@@ -0,0 +1,361 @@
+"""
+=== Module Description ===
+This module serves the treemap of a single scanned TMTree over HTTP, so that
+several people can look at the same scan from their browsers instead of each
+running their own scan and pygame window. It only uses the standard library
+and only listens on localhost.
+
+The treemap is laid out once on a square "world" of TILE_SIZE * 2 ** max_zoom
+pixels. At zoom level z the world is shown as 2 ** z by 2 ** z tiles of
+TILE_SIZE pixels each. These endpoints are served:
+
+    /                        a page showing the treemap at ?z=<zoom>
+    /tiles/<z>/<x>/<y>.png   a tile of the treemap
+    /hit?z=&x=&y=            the tree at pixel (x, y) of zoom level z, as JSON
+    /detail?z=&x=&y=         the same, together with each of its ancestors
+
+Rendered tiles are kept in an LRU cache. When the tree is changed through
+TreemapServer.update, only the cached tiles overlapping the area whose
+rectangles or colours changed are dropped.
+"""
+
+import json
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from tm_trees import TMTree, FileSystemTree, ScanLimits
+
+TILE_SIZE = 256
+
+
+class TreemapServer(HTTPServer):
+    """
+    An HTTP server for the treemap of one tree, which handles requests on a
+    pool of threads.
+
+    Any access to the tree must hold _tree_lock. Cached tiles are served
+    without it.
+    """
+    tree: TMTree
+    max_zoom: int
+    cache_size: int
+    refine_batch: int
+    refine_interval: float
+    _tree_lock: threading.Lock
+    _cache_lock: threading.Lock
+    _tiles: Dict[Tuple[int, int, int], bytes]
+    _generation: int
+    _pool: ThreadPoolExecutor
+
+    def __init__(self, tree: TMTree, port: int = 8000, max_zoom: int = 6,
+                 cache_size: int = 1024, workers: int = 8) -> None:
+        super().__init__(('127.0.0.1', port), _TreemapRequestHandler)
+        self.tree = tree
+        self.max_zoom = max_zoom
+        self.cache_size = cache_size
+
+        # Estimated sizes replaced at a time while refining a scan, and the
+        # number of seconds between those batches
+        self.refine_batch = 4096
+        self.refine_interval = 0.25
+
+        self._tree_lock = threading.Lock()
+        self._cache_lock = threading.Lock()
+        self._tiles = OrderedDict()
+        self._generation = 0
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+
+        world = TILE_SIZE << max_zoom
+        tree.update_rectangles((0, 0, world, world))
+        tree.update_colours_and_depths()
+        tree.expand_all()
+
+    def process_request(self, request, client_address) -> None:
+        """Handle the request on the thread pool instead of the thread that
+        accepts connections.
+        """
+        self._pool.submit(self._process_request_thread, request,
+                          client_address)
+
+    def _process_request_thread(self, request, client_address) -> None:
+        """Handle a request on a thread of the pool.
+        """
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self) -> None:
+        """Stop accepting connections and wait for the pool to finish.
+        """
+        super().server_close()
+        self._pool.shutdown(wait=True)
+
+    def update(self, change: Callable[[TMTree], List[TMTree]]) \
+            -> List[TMTree]:
+        """Apply <change> to the tree and return the trees it changed, which
+        <change> returns: the trees whose size changed and the parents of the
+        trees added or removed.
+
+        Only the trees around those are laid out again, and only the cached
+        tiles overlapping the rectangles that moved are dropped. If the
+        maximum depth of the tree changes every folder is recoloured, so every
+        cached tile is dropped.
+        """
+        with self._tree_lock:
+            max_depth = self.tree.max_depth()
+            changed = change(self.tree)
+            region = self.tree.relayout(changed)
+            for node in changed:
+                node.expand_all()
+            if self.tree.max_depth() != max_depth:
+                region = self.tree.rect
+            with self._cache_lock:
+                self._generation += 1
+                if region is not None:
+                    for key in [key for key in self._tiles
+                                if _overlaps(self._tile_area(*key), region)]:
+                        del self._tiles[key]
+        return changed
+
+    def refine(self) -> None:
+        """Replace the estimated sizes in the tree with exact ones, a batch at
+        a time, until every size is exact. The tree is left alone for
+        <refine_interval> seconds between batches so that requests are not
+        kept waiting.
+        """
+        while self.update(self._refine_batch):
+            time.sleep(self.refine_interval)
+
+    def _refine_batch(self, tree: FileSystemTree) -> List[TMTree]:
+        """Replace a batch of estimated sizes in <tree> and return the leaves
+        that changed.
+        """
+        refined = []
+        tree.refine(self.refine_batch, refined)
+        return refined
+
+    def get_tile(self, z: int, x: int, y: int) -> Optional[bytes]:
+        """Return the PNG image of tile (<x>, <y>) at zoom level <z>, or None
+        if there is no such tile.
+        """
+        if not 0 <= z <= self.max_zoom or not 0 <= x < 1 << z \
+                or not 0 <= y < 1 << z:
+            return None
+        key = (z, x, y)
+        with self._cache_lock:
+            if key in self._tiles:
+                self._tiles.move_to_end(key)
+                return self._tiles[key]
+            generation = self._generation
+
+        area = self._tile_area(z, x, y)
+        scale = 1 << (self.max_zoom - z)
+        with self._tree_lock:
+            rectangles = self.tree.get_rectangles_in(area, scale)
+        tile = _encode_png(_rasterise(rectangles, area, scale))
+
+        with self._cache_lock:
+            # Do not cache a tile drawn from a tree that has changed since
+            if generation == self._generation:
+                self._tiles[key] = tile
+                while len(self._tiles) > self.cache_size:
+                    self._tiles.popitem(last=False)
+        return tile
+
+    def hit(self, z: int, x: int, y: int,
+            ancestors: bool = False) -> Optional[dict]:
+        """Return a description of the tree at pixel (<x>, <y>) of zoom level
+        <z>, or None if there is none. If <ancestors> is True, include a
+        description of each of its ancestors, from its parent up.
+        """
+        scale = 1 << (self.max_zoom - z)
+        with self._tree_lock:
+            node = self.tree.get_tree_at_position((x * scale, y * scale))
+            if node is None:
+                return None
+            detail = _describe(node)
+            if ancestors:
+                detail['ancestors'] = []
+                parent = node.get_parent()
+                while parent is not None:
+                    detail['ancestors'].append(_describe(parent))
+                    parent = parent.get_parent()
+        return detail
+
+    def _tile_area(self, z: int, x: int, y: int) -> Tuple[int, int, int, int]:
+        """Return the area of the world covered by tile (<x>, <y>) at zoom
+        level <z>.
+        """
+        size = TILE_SIZE << (self.max_zoom - z)
+        return x * size, y * size, size, size
+
+
+class _TreemapRequestHandler(BaseHTTPRequestHandler):
+    """
+    Answers the requests made to a TreemapServer.
+    """
+    server: TreemapServer
+
+    def do_GET(self) -> None:
+        """Route a GET request to the tiles, hit-test or page endpoints.
+        """
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        parts = url.path.strip('/').split('/')
+        try:
+            if parts[0] == 'tiles' and len(parts) == 4 \
+                    and parts[3].endswith('.png'):
+                tile = self.server.get_tile(int(parts[1]), int(parts[2]),
+                                            int(parts[3][:-4]))
+                if tile is None:
+                    self._send(404, 'text/plain', b'No such tile')
+                else:
+                    self._send(200, 'image/png', tile)
+            elif url.path in ('/hit', '/detail'):
+                detail = self.server.hit(int(query['z']), int(query['x']),
+                                         int(query['y']),
+                                         url.path == '/detail')
+                self._send(200 if detail else 404, 'application/json',
+                           json.dumps(detail).encode())
+            elif url.path == '/':
+                zoom = min(max(int(query.get('z', 2)), 0), self.server.max_zoom)
+                self._send(200, 'text/html', _page(zoom).encode())
+            else:
+                self._send(404, 'text/plain', b'Not found')
+        except (KeyError, ValueError):
+            self._send(400, 'text/plain', b'Bad request')
+
+    def _send(self, status: int, content_type: str, body: bytes) -> None:
+        """Send a complete response.
+        """
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        """Do not log every tile request.
+        """
+
+
+def _describe(node: TMTree) -> dict:
+    """Return the JSON-friendly description of <node>.
+    """
+    return {'path': node.get_path_string(),
+            'full_path': node.get_full_path(),
+            'suffix': node.get_suffix(),
+            'size': node.data_size,
+            'rect': list(node.rect)}
+
+
+def _overlaps(a: Tuple[int, int, int, int],
+              b: Tuple[int, int, int, int]) -> bool:
+    """Return whether rectangles <a> and <b> overlap.
+    """
+    return a[0] < b[0] + b[2] and b[0] < a[0] + a[2] \
+        and a[1] < b[1] + b[3] and b[1] < a[1] + a[3]
+
+
+def _rasterise(rectangles: List[Tuple[Tuple[int, int, int, int],
+                                      Tuple[int, int, int]]],
+               area: Tuple[int, int, int, int], scale: int) -> bytearray:
+    """Return the RGB pixels of a tile showing <area> of the world, shrunk by
+    <scale>, with <rectangles> drawn on it. Every rectangle covers at least
+    one pixel.
+    """
+    pixels = bytearray(TILE_SIZE * TILE_SIZE * 3)
+    ax, ay = area[0], area[1]
+    for (x, y, w, h), colour in rectangles:
+        left = min(max((x - ax) // scale, 0), TILE_SIZE - 1)
+        top = min(max((y - ay) // scale, 0), TILE_SIZE - 1)
+        right = min(max((x + w - ax) // scale, left + 1), TILE_SIZE)
+        bottom = min(max((y + h - ay) // scale, top + 1), TILE_SIZE)
+        row = bytes(colour) * (right - left)
+        for py in range(top, bottom):
+            start = (py * TILE_SIZE + left) * 3
+            pixels[start:start + len(row)] = row
+    return pixels
+
+
+def _encode_png(pixels: bytearray) -> bytes:
+    """Return a PNG image of a tile with the given RGB <pixels>.
+    """
+    stride = TILE_SIZE * 3
+    raw = b''.join(b'\x00' + pixels[row:row + stride]
+                   for row in range(0, len(pixels), stride))
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + kind + data + \
+            struct.pack('>I', zlib.crc32(kind + data))
+
+    header = struct.pack('>IIBBBBB', TILE_SIZE, TILE_SIZE, 8, 2, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + \
+        chunk(b'IDAT', zlib.compress(raw, 6)) + chunk(b'IEND', b'')
+
+
+def _page(zoom: int) -> str:
+    """Return a page showing every tile at level <zoom>. Clicking on the
+    treemap shows the details of the tree under the pointer.
+    """
+    tiles = 1 << zoom
+    rows = ''.join(
+        '<div>' + ''.join(f'<img src="/tiles/{zoom}/{x}/{y}.png">'
+                          for x in range(tiles)) + '</div>'
+        for y in range(tiles))
+    return f'''<!DOCTYPE html>
+<html><head><title>Treemap</title><style>
+body {{ margin: 0; font-family: monospace; }}
+#map div {{ height: {TILE_SIZE}px; white-space: nowrap; }}
+#info {{ position: fixed; bottom: 0; background: #000; color: #fff; }}
+</style></head><body>
+<div id="map">{rows}</div><div id="info"></div>
+<script>
+document.getElementById('map').onclick = async (e) => {{
+  const box = e.currentTarget.getBoundingClientRect();
+  const x = Math.floor(e.clientX - box.left), y = Math.floor(e.clientY - box.top);
+  const response = await fetch(`/hit?z={zoom}&x=${{x}}&y=${{y}}`);
+  const node = await response.json();
+  document.getElementById('info').textContent = node ? node.path + node.suffix : '';
+}};
+</script></body></html>'''
+
+
+def serve_treemap(path: str, port: int = 8000, estimate: bool = False,
+                  limits: Optional[ScanLimits] = None) -> None:
+    """Scan the given path and serve its treemap on http://127.0.0.1:<port>/
+    until interrupted. If <estimate> is True, the sizes in large folders are
+    estimated at first and made exact in the background. If <limits> is
+    given, the scan is bounded by them and what it used is printed.
+    Precondition: <path> is a valid path to a file or folder.
+    """
+    tree = FileSystemTree(path, estimate, limits)
+    if limits is not None:
+        print(limits.report())
+    server = TreemapServer(tree, port)
+
+    if estimate:
+        threading.Thread(target=server.refine, daemon=True).start()
+    print(f'Serving the treemap of {path} on http://127.0.0.1:{port}/')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    import os
+    import sys
+    serve_treemap(sys.argv[1] if len(sys.argv) > 1 else os.getcwd())
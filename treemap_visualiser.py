@@ -7,18 +7,26 @@ and detecting user events like mouse clicks and key presses and responding
 to them.
 """
 
+import threading
+from collections import OrderedDict
 from os import getcwd
 from sys import platform
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 
 import pygame
 
-from tm_trees import TMTree, FileSystemTree
+from tm_trees import TMTree, FileSystemTree, ScanLimits, build_archive_tree, \
+    diff_trees, load_scan
 
 
 class Visualiser:
     """
     A class that uses pygame to visualise a tm_tree object.
+
+    The treemap is laid out and drawn into an offscreen surface by a render
+    thread. The event loop only blits the latest finished frame and draws the
+    hover and selection outlines on top of it, so it keeps responding to input
+    while a large tree is being drawn. Any access to the tree must hold _lock.
     """
     width: int
     height: int
@@ -27,6 +35,21 @@ class Visualiser:
     screen: Optional[pygame.Surface]
     hover_node: Optional[TMTree]
     selected_node: Optional[TMTree]
+    resize_delay: int
+    view_cache_size: int
+    refine_batch: int
+    refine_interval: int
+    _views: Dict[TMTree, List[Tuple[TMTree, Tuple[float, float, float, float]]]]
+    _pending_size: Optional[Tuple[int, int]]
+    _resize_at: int
+    _lock: threading.Lock
+    _jobs: threading.Condition
+    _job: Optional[Tuple[int, TMTree, Tuple[int, int], bool, bool]]
+    _generation: int
+    _frame: Optional[pygame.Surface]
+    _renderer: Optional[threading.Thread]
+    _refiner: Optional[threading.Thread]
+    _running: bool
 
     def __init__(self) -> None:
         # You may adjust the height and width as you'd like, depending on your screen resolution
@@ -35,10 +58,32 @@ class Visualiser:
 
         self.font_height = 30
 
+        # Milliseconds without further resize events before the window is laid
+        # out again, and the number of zoomed-in views whose layout is kept
+        self.resize_delay = 150
+        self.view_cache_size = 8
+
+        # Estimated sizes replaced between redraws while refining a scan, and
+        # the minimum number of milliseconds between those redraws
+        self.refine_batch = 64
+        self.refine_interval = 200
+
         self.tree = None
         self.screen = None
         self.hover_node = None
         self.selected_node = None
+        self._views = OrderedDict()
+        self._pending_size = None
+        self._resize_at = 0
+
+        self._lock = threading.Lock()
+        self._jobs = threading.Condition()
+        self._job = None
+        self._generation = 0
+        self._frame = None
+        self._renderer = None
+        self._refiner = None
+        self._running = False
 
     def run_visualisation(self, tree: TMTree) -> None:
         """Display an interactive graphical display of the given tree's treemap.
@@ -47,15 +92,162 @@ class Visualiser:
         # Setup pygame
         pygame.init()
         self.screen = pygame.display.set_mode((self.width, self.height), pygame.RESIZABLE)
-        self.tree = tree
+        self._views.clear()
+        self._frame = None
+
+        self._running = True
+        self._renderer = threading.Thread(target=self._render_loop, daemon=True)
+        self._renderer.start()
+        if isinstance(tree, FileSystemTree):
+            self._refiner = threading.Thread(target=self._refine_loop,
+                                             args=(tree,), daemon=True)
+            self._refiner.start()
 
         # Render the initial display of the static treemap.
+        self._show(tree)
         self.render_display()
-        tree.update_rectangles((0, 0, self.width, self.height - self.font_height))
-        tree.update_colours_and_depths()
 
         # Start an event loop to respond to events.
-        self.event_loop()
+        try:
+            self.event_loop()
+        finally:
+            with self._jobs:
+                self._running = False
+                self._jobs.notify()
+            self._renderer.join()
+            if self._refiner is not None:
+                self._refiner.join()
+                self._refiner = None
+
+    def _show(self, tree: TMTree) -> None:
+        """Make <tree> the root of the displayed treemap, reusing its cached
+        layout if it was shown recently.
+        """
+        self.tree = tree
+        self._request_frame(recolour=True)
+
+    def _request_frame(self, relayout: bool = False, recolour: bool = False,
+                       cancel: bool = True) -> None:
+        """Ask the render thread for a new frame of the displayed tree at the
+        current window size. If <cancel> is True, any frame still being drawn
+        becomes stale and is dropped; otherwise it is finished first.
+
+        Set <relayout> if the sizes or structure of the tree have changed, and
+        <recolour> if the displayed tree has changed.
+        """
+        with self._jobs:
+            if cancel:
+                self._generation += 1
+            if self._job is not None:
+                # The pending request has not been started, so merge with it
+                relayout = relayout or self._job[3]
+                recolour = recolour or self._job[4]
+            self._job = (self._generation, self.tree,
+                         (self.width, self.height - self.font_height),
+                         relayout, recolour)
+            self._jobs.notify()
+
+    def _render_loop(self) -> None:
+        """Lay out and draw the frames requested by the event loop until the
+        visualisation ends. Runs on the render thread.
+        """
+        while True:
+            with self._jobs:
+                while self._job is None and self._running:
+                    self._jobs.wait()
+                if not self._running:
+                    return
+                generation, tree, size, relayout, recolour = self._job
+                self._job = None
+
+            with self._lock:
+                if recolour:
+                    tree.update_colours_and_depths()
+                self._layout(tree, size, relayout)
+                rectangles = tree.get_rectangles()
+
+            frame = self._draw_frame(generation, size, rectangles)
+            if frame is not None:
+                self._frame = frame
+
+    def _refine_loop(self, tree: FileSystemTree) -> None:
+        """Replace the estimated sizes in <tree> with exact ones, a batch at a
+        time, and lay the treemap out again as they come in. Runs on its own
+        thread, and returns at once if every size is exact.
+
+        A frame being drawn when new sizes come in is still shown, since the
+        sizes only move slightly. Cancelling it would never let a frame that
+        takes longer than <refine_interval> to draw reach the screen.
+        """
+        last_frame = pygame.time.get_ticks()
+        changed = False
+        while self._running:
+            with self._lock:
+                refined = tree.refine(self.refine_batch)
+            changed = changed or refined > 0
+            now = pygame.time.get_ticks()
+            if changed and (refined == 0 or now - last_frame >= self.refine_interval):
+                self._request_frame(relayout=True, cancel=False)
+                last_frame = now
+                changed = False
+            if refined == 0:
+                return
+
+    def _draw_frame(self, generation: int, size: Tuple[int, int],
+                    rectangles: List[Tuple[Tuple[int, int, int, int],
+                                           Tuple[int, int, int]]]) \
+            -> Optional[pygame.Surface]:
+        """Return an offscreen surface of <size> with <rectangles> drawn on it,
+        or None if a newer frame was requested before it was finished.
+        """
+        frame = pygame.Surface(size)
+        for i, (rect, colour) in enumerate(rectangles):
+            if i % 1024 == 0 and generation != self._generation:
+                return None
+            # Note that the arguments are in the opposite order
+            pygame.draw.rect(frame, colour, rect)
+        if generation != self._generation:
+            return None
+        return frame
+
+    def _layout(self, tree: TMTree, size: Tuple[int, int],
+                relayout: bool = False) -> None:
+        """Lay out <tree> to fill a treemap area of <size>.
+
+        The layout of a recently shown tree is kept as fractions of the
+        treemap area, so it only has to be scaled to the current window size.
+        If <relayout> is True, the tree has changed: every cached layout is
+        dropped and the treemap algorithm is run again.
+        """
+        width, height = size
+        if relayout:
+            self._views.clear()
+
+        layout = self._views.get(tree)
+        if layout is None:
+            tree.update_rectangles((0, 0, width, height))
+            layout = tree.get_layout()
+            self._views[tree] = layout
+        else:
+            for node, (left, top, right, bottom) in layout:
+                x, y = round(left * width), round(top * height)
+                node.rect = (x, y, round(right * width) - x,
+                             round(bottom * height) - y)
+
+        self._views.move_to_end(tree)
+        while len(self._views) > self.view_cache_size:
+            self._views.popitem(last=False)
+
+    def _apply_resize(self) -> None:
+        """Resize the window to the last size requested by the user, once they
+        have stopped dragging for <resize_delay> milliseconds.
+        """
+        if self._pending_size is None or pygame.time.get_ticks() < self._resize_at:
+            return
+        self.width, self.height = self._pending_size
+        self._pending_size = None
+        self.screen = pygame.display.set_mode((self.width, self.height), pygame.RESIZABLE)
+        self._request_frame()
 
     def render_display(self) -> None:
         """Render a treemap and text display to the given screen.
@@ -72,9 +264,10 @@ class Visualiser:
         except ValueError:
             return
 
-        for rect, colour in self.tree.get_rectangles():
-            # Note that the arguments are in the opposite order
-            pygame.draw.rect(subscreen, colour, rect)
+        # Until the render thread finishes, keep showing the previous frame
+        frame = self._frame
+        if frame is not None:
+            subscreen.blit(frame, (0, 0))
 
         # add the hover rectangle
         if self.selected_node is not None:
@@ -115,82 +308,24 @@ class Visualiser:
                 return
 
             if event.type == pygame.VIDEORESIZE:
-                self.width = int(event.w) if event.w else self.width
-                self.height = int(event.h) if event.h else self.height
-                self.run_visualisation(self.tree)
-                return
-
-            # get the hover position and the corresponding node
-            hover_node = self.tree.get_tree_at_position(pygame.mouse.get_pos())
-
-            if event.type == pygame.MOUSEBUTTONUP:
-                selected_node = \
-                    self._handle_click(event.button, event.pos, selected_node)
-
-            elif event.type == pygame.KEYUP and selected_node is not None:
-                drawable_height = self.height - self.font_height
-                k = event.key
-                if k == pygame.K_UP:
-                    selected_node.change_size(0.01)
-                    self.tree.update_data_sizes()
-                    self.tree.update_rectangles((0, 0, self.width, drawable_height))
-
-                elif k == pygame.K_DOWN:
-                    selected_node.change_size(-0.01)
-                    self.tree.update_data_sizes()
-                    self.tree.update_rectangles((0, 0, self.width, drawable_height))
-
-                elif k == pygame.K_DELETE or platform == 'darwin' and k == pygame.K_BACKSPACE:
-                    if selected_node.delete_self():
-                        self.tree.update_data_sizes()
-                        self.tree.update_rectangles((0, 0, self.width, drawable_height))
-                        selected_node = None
-
-                elif k == pygame.K_m:
-                    selected_node.move(hover_node)
-                    self.tree.update_data_sizes()
-                    self.tree.update_rectangles((0, 0, self.width, drawable_height))
-                    selected_node = hover_node
-
-                elif k == pygame.K_v:
-                    selected_node.copy_paste(hover_node)
-                    self.tree.update_data_sizes()
-                    self.tree.update_rectangles((0, 0, self.width, drawable_height))
-                    selected_node = hover_node
-
-                elif k == pygame.K_e:
-                    selected_node.expand()
-                    selected_node = None
-
-                elif k == pygame.K_a:
-                    selected_node.expand_all()
-                    selected_node = None
-
-                elif k == pygame.K_d:
-                    selected_node.duplicate()
-                    self.tree.update_data_sizes()
-                    self.tree.update_rectangles((0, 0, self.width, drawable_height))
-
-                    selected_node = None
-
-                elif k == pygame.K_c:
-                    selected_node.collapse()
-                    if selected_node is not self.tree:
-                        selected_node = selected_node.get_parent()
-
-                elif k == pygame.K_x:
-                    selected_node.collapse_all()
-                    selected_node = self.tree
-
-                elif k == pygame.K_q and selected_node is not self.tree:
-                    self.run_visualisation(selected_node)
-                    return
-
-            if event.type == pygame.KEYUP and event.key == pygame.K_b:
-                if self.tree.get_parent():
-                    self.tree.get_parent().collapse_all()
-                    self.run_visualisation(self.tree.get_parent())
-                    return
+                self._pending_size = (int(event.w) if event.w else self.width,
+                                      int(event.h) if event.h else self.height)
+                self._resize_at = pygame.time.get_ticks() + self.resize_delay
+            self._apply_resize()
+
+            # get the hover position and the corresponding node, keeping the
+            # previous one while the render thread is laying out the tree
+            hover_node = self.hover_node
+            if self._lock.acquire(blocking=False):
+                try:
+                    hover_node = self.tree.get_tree_at_position(pygame.mouse.get_pos())
+                finally:
+                    self._lock.release()
+
+            if event.type in (pygame.MOUSEBUTTONUP, pygame.KEYUP):
+                with self._lock:
+                    selected_node = \
+                        self._handle_event(event, selected_node, hover_node)
 
             self.selected_node = selected_node
             self.hover_node = hover_node
@@ -198,6 +333,84 @@ class Visualiser:
             # Update display
             self.render_display()
 
+    def _handle_event(self, event: pygame.event.Event,
+                      selected_node: Optional[TMTree],
+                      hover_node: Optional[TMTree]) -> Optional[TMTree]:
+        """Apply a mouse click or key press to the tree and return the new
+        selection. The caller must hold _lock.
+        """
+        if event.type == pygame.MOUSEBUTTONUP:
+            selected_node = \
+                self._handle_click(event.button, event.pos, selected_node)
+
+        elif event.type == pygame.KEYUP and selected_node is not None:
+            k = event.key
+            if k == pygame.K_UP:
+                selected_node.change_size(0.01)
+                self.tree.update_data_sizes()
+                self._request_frame(relayout=True)
+
+            elif k == pygame.K_DOWN:
+                selected_node.change_size(-0.01)
+                self.tree.update_data_sizes()
+                self._request_frame(relayout=True)
+
+            elif k == pygame.K_DELETE or platform == 'darwin' and k == pygame.K_BACKSPACE:
+                if selected_node.delete_self():
+                    self.tree.update_data_sizes()
+                    self._request_frame(relayout=True)
+                    selected_node = None
+
+            elif k == pygame.K_m:
+                selected_node.move(hover_node)
+                self.tree.update_data_sizes()
+                self._request_frame(relayout=True)
+                selected_node = hover_node
+
+            elif k == pygame.K_v:
+                selected_node.copy_paste(hover_node)
+                self.tree.update_data_sizes()
+                self._request_frame(relayout=True)
+                selected_node = hover_node
+
+            elif k == pygame.K_e:
+                selected_node.expand()
+                self._request_frame()
+                selected_node = None
+
+            elif k == pygame.K_a:
+                selected_node.expand_all()
+                self._request_frame()
+                selected_node = None
+
+            elif k == pygame.K_d:
+                selected_node.duplicate()
+                self.tree.update_data_sizes()
+                self._request_frame(relayout=True)
+
+                selected_node = None
+
+            elif k == pygame.K_c:
+                selected_node.collapse()
+                self._request_frame()
+                if selected_node is not self.tree:
+                    selected_node = selected_node.get_parent()
+
+            elif k == pygame.K_x:
+                selected_node.collapse_all()
+                self._request_frame()
+                selected_node = self.tree
+
+            elif k == pygame.K_q and selected_node is not self.tree:
+                self._show(selected_node)
+
+        if event.type == pygame.KEYUP and event.key == pygame.K_b:
+            if self.tree.get_parent():
+                self.tree.get_parent().collapse_all()
+                self._show(self.tree.get_parent())
+                selected_node = self.tree
+        return selected_node
+
     def _handle_click(self, button: int, pos: tuple[int, int],
                       old_selected_leaf: Optional[TMTree]) -> Optional[TMTree]:
         """Return the new selection after handling the mouse event.
@@ -240,30 +453,63 @@ class Visualiser:
             return leaf_path + leaf.get_suffix()
 
 
-def run_treemap_file_system(path: str) -> None:
+INSTRUCTIONS = '\n==== Instructions for use ====\n' \
+               'When a folder/file is selected, the following keys can be pressed:\n' \
+               '"E" to expand the folder\n' \
+               '"A" to expand the folder and all folders inside\n' \
+               '"C" to collapse the parent folder\n' \
+               '"X" to collapse the entire display\n' \
+               '"Q" to visualize the selected folder/file\n' \
+               '"B" to go back to parent folder (if Q was pressed)\n' \
+               '"Up" and "Down" arrow keys to change the size of a file (in visualization)\n' \
+               '"M" to move a file (while selecting a file and hovering over a folder)\n' \
+               '"Del" to delete a file or folder from the visualization\n' \
+               '"D" to duplicate a file\n' \
+               '"V" to duplicate a copy and paste a file (while selecting a file and hovering over a folder)\n' \
+               '(Drag window to resize)'
+
+
+def run_treemap_file_system(path: str, estimate: bool = False,
+                            limits: Optional[ScanLimits] = None) -> None:
     """Run a treemap visualisation for the given path's file structure.
+    If <estimate> is True, the sizes in large folders are estimated at first
+    and made exact in the background while the treemap is shown. If <limits>
+    is given, the scan is bounded by them and what it used is printed.
     Precondition: <path> is a valid path to a file or folder.
     """
-    instructions = '\n==== Instructions for use ====\n' \
-                   'When a folder/file is selected, the following keys can be pressed:\n' \
-                   '"E" to expand the folder\n' \
-                   '"A" to expand the folder and all folders inside\n' \
-                   '"C" to collapse the parent folder\n' \
-                   '"X" to collapse the entire display\n' \
-                   '"Q" to visualize the selected folder/file\n' \
-                   '"B" to go back to parent folder (if Q was pressed)\n' \
-                   '"Up" and "Down" arrow keys to change the size of a file (in visualization)\n' \
-                   '"M" to move a file (while selecting a file and hovering over a folder)\n' \
-                   '"Del" to delete a file or folder from the visualization\n' \
-                   '"D" to duplicate a file\n' \
-                   '"V" to duplicate a copy and paste a file (while selecting a file and hovering over a folder)\n' \
-                   '(Drag window to resize)'
-
-    file_tree = FileSystemTree(path)
-    print(instructions)
+    file_tree = FileSystemTree(path, estimate, limits)
+    if limits is not None:
+        print(limits.report())
+    print(INSTRUCTIONS)
     visualizer.run_visualisation(file_tree)
 
 
+def run_treemap_archive(path: str, compressed: bool = False) -> None:
+    """Run a treemap visualisation for the contents of the given zip or tar
+    archive, without extracting it. If <compressed> is True, zip members are
+    sized by their compressed size.
+    Precondition: <path> is a valid zip or tar archive.
+    """
+    archive_tree = build_archive_tree(path, compressed)
+    print(INSTRUCTIONS)
+    visualizer.run_visualisation(archive_tree)
+
+
+def run_treemap_delta(old_path: str, new_path: str) -> None:
+    """Run a treemap visualisation of what grew and shrank between two scans
+    of the same folder. Each path is either a folder, which is scanned now,
+    or a scan saved with save_scan.
+    Precondition: each path is a valid folder or saved scan.
+    """
+    trees = [FileSystemTree(path) if os.path.isdir(path) else load_scan(path)
+             for path in (old_path, new_path)]
+    delta_tree = diff_trees(trees[0], trees[1])
+    if delta_tree is None:
+        print('Nothing changed between the two scans.')
+        return
+    print(INSTRUCTIONS)
+    visualizer.run_visualisation(delta_tree)
+
 
 import os
 if __name__ == '__main__':